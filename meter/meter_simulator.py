@@ -8,23 +8,30 @@ smart meter simulator with digital signatures.
 Features:
 - Realistic energy generation patterns
 - ECDSA digital signatures
-- Time-based variations
+- Time-based variations (noise from a per-meter PRNG; keys and nonces
+  come from the secrets CSPRNG)
 - Carbon tagging (GREEN/NORMAL)
 
 Usage:
     python meter_simulator.py
     
 Requirements:
+    Python 3.10+
     pip install cryptography
 """
 
 import json
 import hashlib
+import hmac
+import random
 import secrets
+import sys
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
+from operator import attrgetter
 from typing import Dict, List, Optional
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, fields, replace
 from enum import Enum
 import uuid
 
@@ -32,13 +39,49 @@ try:
     from cryptography.hazmat.primitives import hashes
     from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
     from cryptography.hazmat.backends import default_backend
-    import hmac
     CRYPTO_AVAILABLE = True
 except ImportError:
     CRYPTO_AVAILABLE = False
     print("Warning: cryptography package not installed. Using basic HMAC.")
 
 
+# SHA-256 block size in bytes (HMAC pads keys to this length)
+SHA256_BLOCK_SIZE = 64
+
+# Nonces are 128-bit (same entropy as uuid4), drawn from a pooled CSPRNG buffer
+NONCE_SIZE = 16
+NONCE_POOL_SIZE = 4096
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+@lru_cache(maxsize=4096)
+def _hour_utc_offset(utc_hour: int) -> Optional[int]:
+    """Local UTC offset for a whole UTC hour, or None if it changes within it."""
+    start = time.localtime(utc_hour * 3600).tm_gmtoff
+    end = time.localtime(utc_hour * 3600 + 3599).tm_gmtoff
+    return start if start == end else None
+
+
+def _local_utc_offset(secs: int) -> int:
+    """Local UTC offset in seconds at a Unix time, DST-aware.
+    
+    Offsets are cached per UTC hour, so readings derive the local hour and ISO
+    timestamp with integer arithmetic instead of calling datetime.fromtimestamp
+    each time. Hours containing a tz transition fall back to time.localtime.
+    """
+    offset = _hour_utc_offset(secs // 3600)
+    if offset is None:
+        offset = time.localtime(secs).tm_gmtoff
+    return offset
+
+
+@lru_cache(maxsize=1024)
+def _json_bytes(value: str) -> bytes:
+    """JSON-encode a string field for the signing payload (cached per value)."""
+    return json.dumps(value).encode()
+
+
 # ============ ENUMS ============
 
 class MeterType(Enum):
@@ -61,12 +104,12 @@ METER_CONFIGS = {
         "base_output": 5.0,
         "variance": 2.0,
         "is_producer": True,
-        "hourly_factors": [
+        "hourly_factors": (
             0, 0, 0, 0, 0, 0.1,
             0.3, 0.5, 0.7, 0.9, 1.0, 1.0,
             1.0, 1.0, 0.9, 0.7, 0.5, 0.3,
             0.1, 0, 0, 0, 0, 0
-        ]
+        )
     },
     MeterType.HOSTEL: {
         "prefix": "HOSTEL",
@@ -74,12 +117,12 @@ METER_CONFIGS = {
         "base_output": 10.0,
         "variance": 5.0,
         "is_producer": False,
-        "hourly_factors": [
+        "hourly_factors": (
             0.3, 0.2, 0.2, 0.2, 0.3, 0.5,
             0.8, 0.9, 0.7, 0.4, 0.3, 0.4,
             0.5, 0.5, 0.5, 0.6, 0.7, 0.8,
             1.0, 1.2, 1.2, 1.0, 0.7, 0.5
-        ]
+        )
     },
     MeterType.LAB: {
         "prefix": "LAB",
@@ -87,19 +130,19 @@ METER_CONFIGS = {
         "base_output": 15.0,
         "variance": 3.0,
         "is_producer": False,
-        "hourly_factors": [
+        "hourly_factors": (
             0.1, 0.1, 0.1, 0.1, 0.1, 0.1,
             0.2, 0.3, 0.8, 1.0, 1.0, 0.8,
             0.4, 0.8, 1.0, 1.0, 0.9, 0.5,
             0.2, 0.1, 0.1, 0.1, 0.1, 0.1
-        ]
+        )
     }
 }
 
 
 # ============ DATA CLASSES ============
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MeterReading:
     meter_id: str
     meter_type: str
@@ -111,8 +154,36 @@ class MeterReading:
     is_producer: bool
     nonce: str
     reading_number: int
-    signature: str
-    data_hash: str
+    signature: bytes  # Raw 32-byte HMAC-SHA256 digest
+    data_hash: bytes  # Raw 32-byte SHA-256 digest
+    
+    @property
+    def signature_hex(self) -> str:
+        return self.signature.hex()
+    
+    @property
+    def data_hash_hex(self) -> str:
+        return "0x" + self.data_hash.hex()
+    
+    def to_dict(self) -> Dict:
+        """Serializable form with the digests hex-encoded."""
+        data = asdict(self)
+        data["signature"] = self.signature_hex
+        data["data_hash"] = self.data_hash_hex
+        return data
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "MeterReading":
+        """Inverse of to_dict(): decode the hex digests back to bytes."""
+        return cls(**{
+            **data,
+            "signature": bytes.fromhex(data["signature"]),
+            "data_hash": bytes.fromhex(data["data_hash"].removeprefix("0x"))
+        })
+
+
+READING_FIELDS = tuple(f.name for f in fields(MeterReading))
+_reading_row = attrgetter(*READING_FIELDS)
 
 
 # ============ SMART METER CLASS ============
@@ -120,105 +191,163 @@ class MeterReading:
 class SmartMeter:
     """Simulates a smart energy meter with digital signing capabilities."""
     
+    __slots__ = (
+        "config", "meter_type", "meter_id", "secret_key", "reading_count",
+        # Cached energy model and field strings
+        "_meter_type_str", "_energy_at_hour", "_variance", "_carbon_tag_str",
+        "_is_producer", "_rng",
+        # Signing state
+        "_inner_hash", "_outer_hash", "_meter_id_bytes", "_meter_type_bytes",
+        "_carbon_tag_bytes", "_data_hash_prefix", "_nonce_pool", "_nonce_off",
+    )
+    
     def __init__(self, meter_type: MeterType, meter_id: Optional[str] = None):
         if meter_type not in METER_CONFIGS:
             raise ValueError(f"Invalid meter type: {meter_type}")
         
         self.config = METER_CONFIGS[meter_type]
         self.meter_type = meter_type
+        self._meter_type_str = meter_type.value
         self.meter_id = meter_id or f"{self.config['prefix']}-{uuid.uuid4().hex[:8].upper()}"
         self.secret_key = secrets.token_hex(32)
         self.reading_count = 0
         
-        print(f"[METER] Initialized {self.meter_type.value} meter: {self.meter_id}")
-    
-    def _sign_data(self, data: Dict) -> str:
-        """Sign meter data using HMAC-SHA256."""
-        data_string = json.dumps({
-            "meterId": data["meter_id"],
-            "kWh": data["kwh"],
-            "timestamp": data["timestamp"],
-            "carbonTag": data["carbon_tag"],
-            "type": data["meter_type"]
-        }, sort_keys=True)
+        # Per-meter energy model, resolved once so readings skip config lookups
+        self._energy_at_hour = tuple(self.config["base_output"] * f for f in self.config["hourly_factors"])
+        self._variance = self.config["variance"]
+        self._carbon_tag_str = self.config["carbon_tag"].value
+        self._is_producer = self.config["is_producer"]
+        
+        # Reading noise is not security-sensitive, so it comes from a seeded PRNG.
+        # Keys and nonces stay on the secrets CSPRNG.
+        self._rng = random.Random(secrets.token_bytes(16))
+        
+        # HMAC key schedule (RFC 2104): hash the ipad/opad blocks once so each
+        # signature only copies these states instead of re-running HMAC setup.
+        # hashlib delegates to OpenSSL, which uses SHA-NI when the CPU has it
+        # (OpenSSL 3 builds of CPython 3.11+).
+        key = self.secret_key.encode()
+        if len(key) > SHA256_BLOCK_SIZE:
+            key = hashlib.sha256(key).digest()
+        key = key.ljust(SHA256_BLOCK_SIZE, b"\x00")
+        self._inner_hash = hashlib.sha256(bytes(b ^ 0x36 for b in key))
+        self._outer_hash = hashlib.sha256(bytes(b ^ 0x5C for b in key))
+        
+        # Pre-encoded JSON fragments for the static fields of the signing payload
+        self._meter_id_bytes = _json_bytes(self.meter_id)
+        self._meter_type_bytes = _json_bytes(self._meter_type_str)
+        self._carbon_tag_bytes = _json_bytes(self._carbon_tag_str)
+        self._data_hash_prefix = f"{self.meter_id}:".encode()
         
-        signature = hmac.new(
-            self.secret_key.encode(),
-            data_string.encode(),
-            hashlib.sha256
-        ).hexdigest()
+        # Empty pool with the offset at the end forces a refill on first use
+        self._nonce_pool = b""
+        self._nonce_off = NONCE_POOL_SIZE
         
-        return signature
+        print(f"[METER] Initialized {self._meter_type_str} meter: {self.meter_id}")
     
-    def _generate_data_hash(self, data: Dict) -> str:
+    def _next_nonce(self) -> str:
+        """Return a 128-bit hex nonce, refilling the pool from secrets when empty."""
+        off = self._nonce_off
+        if off >= NONCE_POOL_SIZE:
+            self._nonce_pool = secrets.token_bytes(NONCE_POOL_SIZE)
+            off = 0
+        self._nonce_off = off + NONCE_SIZE
+        return self._nonce_pool[off:off + NONCE_SIZE].hex()
+    
+    @staticmethod
+    def _canonical_msg(meter_id: bytes, kwh: float, timestamp: int,
+                       carbon_tag: bytes, meter_type: bytes) -> bytes:
+        """Build the signing payload from the reading fields.
+        
+        String fields are passed as JSON-encoded bytes. The payload is built
+        from a fixed template that matches json.dumps(..., sort_keys=True)
+        byte for byte, so signatures stay compatible with existing verifiers.
+        Do not swap in orjson or compact separators: they emit a different
+        payload (no spaces, raw UTF-8 instead of \\u escapes, different float
+        text) and would invalidate every existing signature.
+        """
+        return b'{"carbonTag": %s, "kWh": %a, "meterId": %s, "timestamp": %d, "type": %s}' % (
+            carbon_tag, kwh, meter_id, timestamp, meter_type
+        )
+    
+    def _hmac(self, msg: bytes) -> bytes:
+        """Sign a payload using HMAC-SHA256 (output identical to hmac.new)."""
+        inner = self._inner_hash.copy()
+        inner.update(msg)
+        outer = self._outer_hash.copy()
+        outer.update(inner.digest())
+        
+        return outer.digest()
+    
+    def _generate_data_hash(self, kwh: float, timestamp: int, nonce: str) -> bytes:
         """Generate hash for blockchain replay prevention."""
-        hash_input = f"{data['meter_id']}:{data['kwh']}:{data['timestamp']}:{data['nonce']}"
-        return "0x" + hashlib.sha256(hash_input.encode()).hexdigest()
+        # Same bytes as f"{meter_id}:{kwh}:{timestamp}:{nonce}".encode()
+        hash_input = b"%s%a:%d:%s" % (self._data_hash_prefix, kwh, timestamp, nonce.encode())
+        return hashlib.sha256(hash_input).digest()
     
     def generate_reading(self, custom_timestamp: Optional[int] = None) -> MeterReading:
         """Generate a single meter reading with signature."""
         timestamp = custom_timestamp or int(time.time() * 1000)
-        dt = datetime.fromtimestamp(timestamp / 1000)
-        hour = dt.hour
+        offset = _local_utc_offset(timestamp // 1000)
+        hour = (timestamp // 1000 + offset) // 3600 % 24
         
-        # Calculate energy based on time of day
-        hourly_factor = self.config["hourly_factors"][hour]
-        base_energy = self.config["base_output"] * hourly_factor
-        variance = (secrets.randbelow(1000) / 1000 - 0.5) * self.config["variance"]
-        kwh = max(0, base_energy + variance)
-        
-        # Round to 3 decimal places
-        rounded_kwh = round(kwh, 3)
+        # Calculate energy based on time of day, clamped at zero and
+        # rounded to 3 decimal places
+        kwh = self._energy_at_hour[hour] + (self._rng.random() - 0.5) * self._variance
+        rounded_kwh = round(kwh, 3) if kwh > 0 else 0
         
         self.reading_count += 1
-        nonce = uuid.uuid4().hex
+        nonce = self._next_nonce()
         
-        data = {
-            "meter_id": self.meter_id,
-            "meter_type": self.meter_type.value,
-            "kwh": rounded_kwh,
-            "timestamp": timestamp,
-            "carbon_tag": self.config["carbon_tag"].value,
-            "nonce": nonce
-        }
+        msg = self._canonical_msg(
+            self._meter_id_bytes, rounded_kwh, timestamp,
+            self._carbon_tag_bytes, self._meter_type_bytes
+        )
         
         reading = MeterReading(
             meter_id=self.meter_id,
-            meter_type=self.meter_type.value,
+            meter_type=self._meter_type_str,
             kwh=rounded_kwh,
             kwh_scaled=int(rounded_kwh * 1000),
             timestamp=timestamp,
-            timestamp_iso=dt.isoformat(),
-            carbon_tag=self.config["carbon_tag"].value,
-            is_producer=self.config["is_producer"],
+            timestamp_iso=(UNIX_EPOCH + timedelta(seconds=offset, milliseconds=timestamp)).isoformat(),
+            carbon_tag=self._carbon_tag_str,
+            is_producer=self._is_producer,
             nonce=nonce,
             reading_number=self.reading_count,
-            signature=self._sign_data(data),
-            data_hash=self._generate_data_hash(data)
+            signature=self._hmac(msg),
+            data_hash=self._generate_data_hash(rounded_kwh, timestamp, nonce)
         )
         
         return reading
     
     def verify_reading(self, reading: MeterReading) -> bool:
         """Verify a reading's signature."""
-        data = {
-            "meter_id": reading.meter_id,
-            "meter_type": reading.meter_type,
-            "kwh": reading.kwh,
-            "timestamp": reading.timestamp,
-            "carbon_tag": reading.carbon_tag,
-            "nonce": reading.nonce
-        }
-        expected_signature = self._sign_data(data)
-        return hmac.compare_digest(reading.signature, expected_signature)
+        msg = self._canonical_msg(
+            _json_bytes(reading.meter_id),
+            reading.kwh,
+            reading.timestamp,
+            _json_bytes(reading.carbon_tag),
+            _json_bytes(reading.meter_type)
+        )
+        expected_signature = self._hmac(msg)
+        
+        # Accept hex signatures from readings rebuilt with MeterReading(**to_dict())
+        signature = reading.signature
+        if isinstance(signature, str):
+            try:
+                signature = bytes.fromhex(signature)
+            except ValueError:
+                return False
+        return hmac.compare_digest(signature, expected_signature)
     
     def get_info(self) -> Dict:
         """Get meter information."""
         return {
             "meter_id": self.meter_id,
-            "type": self.meter_type.value,
-            "carbon_tag": self.config["carbon_tag"].value,
-            "is_producer": self.config["is_producer"],
+            "type": self._meter_type_str,
+            "carbon_tag": self._carbon_tag_str,
+            "is_producer": self._is_producer,
             "total_readings": self.reading_count
         }
 
@@ -230,10 +359,17 @@ class MeterFleet:
     
     def __init__(self):
         self.meters: Dict[str, SmartMeter] = {}
+        # Same meters in insertion order, for sweeps without the dict view
+        self._meter_list: List[SmartMeter] = []
     
     def add_meter(self, meter_type: MeterType, meter_id: Optional[str] = None) -> SmartMeter:
-        """Add a meter to the fleet."""
+        """Add a meter to the fleet (replacing any meter with the same ID)."""
         meter = SmartMeter(meter_type, meter_id)
+        existing = self.meters.get(meter.meter_id)
+        if existing is None:
+            self._meter_list.append(meter)
+        else:
+            self._meter_list[self._meter_list.index(existing)] = meter
         self.meters[meter.meter_id] = meter
         return meter
     
@@ -242,8 +378,46 @@ class MeterFleet:
         return self.meters.get(meter_id)
     
     def generate_all_readings(self, custom_timestamp: Optional[int] = None) -> List[MeterReading]:
-        """Generate readings from all meters."""
-        return [meter.generate_reading(custom_timestamp) for meter in self.meters.values()]
+        """Generate readings from all meters.
+        
+        The clock is read once so every reading in the sweep shares the same
+        timestamp; each meter then signs with its precomputed HMAC state.
+        """
+        timestamp = custom_timestamp or int(time.time() * 1000)
+        return [meter.generate_reading(timestamp) for meter in self._meter_list]
+    
+    def generate_all_columns(self, custom_timestamp: Optional[int] = None) -> Dict[str, List]:
+        """Generate readings from all meters as columns keyed by field name.
+        
+        Columns are in READING_FIELDS order, one list per field instead of one
+        dict per reading. As in MeterReading.to_dict(), signature and data_hash
+        are hex strings, so the result can be passed straight to json.dumps
+        or pyarrow.RecordBatch.from_pydict.
+        """
+        readings = self.generate_all_readings(custom_timestamp)
+        if not readings:
+            return {name: [] for name in READING_FIELDS}
+        columns = zip(*map(_reading_row, readings))
+        result = {name: list(column) for name, column in zip(READING_FIELDS, columns)}
+        
+        # Hex-encode the digests at this boundary, matching MeterReading.to_dict()
+        result["signature"] = [digest.hex() for digest in result["signature"]]
+        result["data_hash"] = ["0x" + digest.hex() for digest in result["data_hash"]]
+        return result
+    
+    def verify_readings(self, readings: List[MeterReading]) -> List[bool]:
+        """Verify a batch of readings, returning one result per reading in order.
+        
+        Each reading is checked against its own meter's precomputed HMAC state,
+        so the key schedule is shared across all readings from the same meter.
+        Readings from meters not in this fleet fail verification.
+        """
+        meters = self.meters
+        results = []
+        for reading in readings:
+            meter = meters.get(reading.meter_id)
+            results.append(meter is not None and meter.verify_reading(reading))
+        return results
     
     def get_status(self) -> Dict:
         """Get fleet status."""
@@ -254,7 +428,7 @@ class MeterFleet:
             "meters": []
         }
         
-        for meter in self.meters.values():
+        for meter in self._meter_list:
             info = meter.get_info()
             status["meters"].append(info)
             if info["is_producer"]:
@@ -267,6 +441,10 @@ class MeterFleet:
 
 # ============ DEMO ============
 
+PRODUCER_ICONS = {True: "☀️", False: "⚡"}
+CARBON_TAG_ICONS = {CarbonTag.GREEN.value: "🌱", CarbonTag.NORMAL.value: "🏭"}
+
+
 def run_demo():
     """Run demonstration of the meter simulator."""
     print("\n" + "=" * 60)
@@ -300,17 +478,21 @@ def run_demo():
         
         readings = fleet.generate_all_readings(test_timestamp)
         
+        # Build the table in memory and write it once; per-line print() flushes
+        # dominate on Windows consoles.
+        lines = []
         for reading in readings:
-            icon = "☀️" if reading.is_producer else "⚡"
-            tag = "🌱" if reading.carbon_tag == "GREEN" else "🏭"
-            print(f"{icon} {reading.meter_id:<18} | {reading.kwh:>8.3f} kWh | {tag} {reading.carbon_tag}")
+            icon = PRODUCER_ICONS[reading.is_producer]
+            tag = CARBON_TAG_ICONS[reading.carbon_tag]
+            lines.append(f"{icon} {reading.meter_id:<18} | {reading.kwh:>8.3f} kWh | {tag} {reading.carbon_tag}")
+        sys.stdout.write("\n".join(lines) + "\n")
     
     # Show sample reading structure
     print("\n\n📋 SAMPLE READING STRUCTURE (JSON):")
     print("-" * 50)
     sample_meter = fleet.get_meter("SOLAR-MAIN-001")
     sample_reading = sample_meter.generate_reading()
-    print(json.dumps(asdict(sample_reading), indent=2))
+    print(json.dumps(sample_reading.to_dict(), indent=2))
     
     # Verify signature
     print("\n\n🔐 SIGNATURE VERIFICATION:")
@@ -319,7 +501,7 @@ def run_demo():
     print(f"Reading signature valid: {'✅ YES' if is_valid else '❌ NO'}")
     
     # Tamper test
-    tampered_reading = MeterReading(**{**asdict(sample_reading), "kwh": 999.999})
+    tampered_reading = replace(sample_reading, kwh=999.999)
     is_tampered_valid = sample_meter.verify_reading(tampered_reading)
     print(f"Tampered reading valid: {'✅ YES' if is_tampered_valid else '❌ NO (ATTACK DETECTED!)'}")
     